@@ -2,8 +2,8 @@ import bpy
 import os
 import glob
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from bpy_extras.io_utils import ImportHelper
-import io
 
 bl_info = {
     "name": "CSDAT Terrain Editor",
@@ -25,32 +25,27 @@ class TerrainEditorData:
         self.sectors_y = 8
         self.terrain_object = None
         self.heightmap_image = None
+        self.height_min = 0.0
+        self.height_max = 0.0
         
 terrain_data = TerrainEditorData()
 
 def load_single_sector(file_path, grid_size=65):
     """Load height map data from a single .csdat file"""
     try:
-        height_map = {}
-        
-        with open(file_path, 'rb') as f:
-            f.seek(708)
-            terrain_data_bytes = io.BytesIO(f.read(16900))
-        
-        for y in range(grid_size):
-            row = []
-            for x in range(grid_size):
-                data = terrain_data_bytes.read(2)
-                if len(data) < 2:
-                    break
-                height = int.from_bytes(data, 'little') / 128
-                row.append(height)
-                terrain_data_bytes.read(2)  # skip unknown data
-            height_map[y] = row
-        
-        # Convert to numpy array
-        height_array = np.array([height_map[y] for y in range(grid_size)])
-        return height_array
+        # Map only the terrain block: each cell is a little-endian 2-byte
+        # height followed by 2 bytes of unknown data
+        cells = np.memmap(
+            file_path,
+            dtype='<u2',
+            mode='r',
+            offset=708,
+            shape=(grid_size, grid_size, 2)
+        )
+        heights = cells[:, :, 0].astype(np.float32)
+        heights *= 1.0 / 128.0
+        del cells
+        return heights
         
     except Exception as e:
         print(f"Error loading {file_path}: {e}")
@@ -62,15 +57,21 @@ def load_sectors_from_directory(directory, sectors_x, sectors_y):
     pattern = os.path.join(directory, "sd*.csdat")
     files = glob.glob(pattern)
     
-    for file_path in files:
-        filename = os.path.basename(file_path)
-        try:
-            sector_num = int(filename[2:-6])  # Extract sector number
-            height_data = load_single_sector(file_path)
+    # Files are independent, so decode them on a thread pool
+    with ThreadPoolExecutor() as executor:
+        futures = {}
+        for file_path in files:
+            filename = os.path.basename(file_path)
+            try:
+                sector_num = int(filename[2:-6])  # Extract sector number
+            except ValueError:
+                continue
+            futures[executor.submit(load_single_sector, file_path)] = sector_num
+        
+        for future in as_completed(futures):
+            height_data = future.result()
             if height_data is not None:
-                sectors_data[sector_num] = height_data
-        except ValueError:
-            continue
+                sectors_data[futures[future]] = height_data
     
     return sectors_data
 
@@ -79,79 +80,105 @@ def create_combined_heightmap(sectors_data, sectors_x, sectors_y, grid_size=65):
     total_width = sectors_x * grid_size
     total_height = sectors_y * grid_size
     
-    combined_map = np.zeros((total_height, total_width))
-    
-    for display_row in range(sectors_y):
-        for col in range(sectors_x):
-            # Convert display row to sector row (flip Y axis)
-            sector_row = sectors_y - 1 - display_row
-            sector_index = sector_row * sectors_x + col
-            
-            if sector_index in sectors_data:
-                start_y = display_row * grid_size
-                end_y = start_y + grid_size
-                start_x = col * grid_size
-                end_x = start_x + grid_size
+    if all(index in sectors_data for index in range(sectors_x * sectors_y)):
+        # Full grid: stack the vertically flipped sectors in display order
+        # (flipping the Y axis of the sector rows) and assemble the tiles
+        # with a single reshape/transpose
+        tiles = np.stack([
+            sectors_data[(sectors_y - 1 - display_row) * sectors_x + col][::-1]
+            for display_row in range(sectors_y)
+            for col in range(sectors_x)
+        ])
+        combined_map = (
+            tiles.reshape(sectors_y, sectors_x, grid_size, grid_size)
+            .transpose(0, 2, 1, 3)
+            .reshape(total_height, total_width)
+        )
+    else:
+        # Missing sectors are left at zero
+        combined_map = np.zeros((total_height, total_width), dtype=np.float32)
+        
+        for display_row in range(sectors_y):
+            for col in range(sectors_x):
+                # Convert display row to sector row (flip Y axis)
+                sector_row = sectors_y - 1 - display_row
+                sector_index = sector_row * sectors_x + col
                 
-                # Flip sector vertically
-                flipped_sector = np.flipud(sectors_data[sector_index])
-                combined_map[start_y:end_y, start_x:end_x] = flipped_sector
+                if sector_index in sectors_data:
+                    start_y = display_row * grid_size
+                    end_y = start_y + grid_size
+                    start_x = col * grid_size
+                    end_x = start_x + grid_size
+                    
+                    # Flip sector vertically (reversed-row view, no copy)
+                    combined_map[start_y:end_y, start_x:end_x] = sectors_data[sector_index][::-1]
     
-    # Rotate 90 degrees counter-clockwise, then flip horizontally
-    combined_map = np.rot90(combined_map, k=1)
-    combined_map = np.fliplr(combined_map)
+    # Rotate 90 degrees counter-clockwise, then flip horizontally. Together
+    # these are a transpose across the anti-diagonal, taken as a single view
+    combined_map = combined_map[::-1, ::-1].T
     
     return combined_map
 
 def numpy_to_blender_image(numpy_array, name="TerrainHeightmap", rotate_texture=False):
-    """Convert numpy array to Blender image"""
+    """Convert numpy array to Blender image, returning (image, min_val, max_val)"""
     # Rotate texture an additional 90 degrees counter-clockwise for display
     if rotate_texture:
         numpy_array = np.rot90(numpy_array, k=1)
     
     height, width = numpy_array.shape
     
-    # Normalize to 0-1 range
-    min_val = np.min(numpy_array)
-    max_val = np.max(numpy_array)
+    # Create RGBA image (Blender needs 4 channels), normalizing to 0-1 range
+    # directly into the R channel and copying it to G and B
+    rgba_array = np.empty((height, width, 4), dtype=np.float32)
+    min_val = float(np.min(numpy_array))
+    max_val = float(np.max(numpy_array))
     if max_val > min_val:
-        normalized = (numpy_array - min_val) / (max_val - min_val)
+        np.subtract(numpy_array, min_val, out=rgba_array[:, :, 0])
+        rgba_array[:, :, 0] *= 1.0 / (max_val - min_val)
     else:
-        normalized = np.zeros_like(numpy_array)
-    
-    # Create RGBA image (Blender needs 4 channels)
-    rgba_array = np.zeros((height, width, 4), dtype=np.float32)
-    rgba_array[:, :, 0] = normalized  # R
-    rgba_array[:, :, 1] = normalized  # G
-    rgba_array[:, :, 2] = normalized  # B
+        rgba_array[:, :, 0] = 0.0
+    rgba_array[:, :, 1:3] = rgba_array[:, :, 0:1]  # G, B
     rgba_array[:, :, 3] = 1.0  # A (fully opaque)
     
-    # Flatten for Blender
-    pixels = rgba_array.flatten()
+    # Flatten for Blender (contiguous float32, as foreach_set expects; ravel
+    # does not copy a C-contiguous array)
+    pixels = rgba_array.ravel()
     
     # Create or update image in Blender
-    if name in bpy.data.images:
+    new_image = name not in bpy.data.images
+    if not new_image:
         img = bpy.data.images[name]
-        img.scale(width, height)
+        # Only reallocate when the size actually changes
+        if tuple(img.size) != (width, height):
+            img.scale(width, height)
     else:
-        img = bpy.data.images.new(name, width, height, alpha=True)
+        # Float buffer keeps full height precision (a byte image would cut it
+        # to 256 levels); the heightmap is data, not color
+        img = bpy.data.images.new(name, width, height, alpha=False, float_buffer=True)
+        img.colorspace_settings.name = 'Non-Color'
     
-    img.pixels = pixels
+    img.pixels.foreach_set(pixels)
     img.update()
-    img.pack()
     
-    return img
+    # Embed newly created images in the .blend; reused images are not
+    # repacked on every update (pack manually or on save)
+    if new_image:
+        img.pack()
+    
+    return img, min_val, max_val
 
 def blender_image_to_numpy(image):
     """Convert Blender image to numpy array (grayscale)"""
     width = image.size[0]
     height = image.size[1]
+    channels = image.channels
     
-    # Get pixels as numpy array
-    pixels = np.array(image.pixels[:])
+    # Copy pixels straight into a float32 buffer sized from the image itself
+    pixels = np.empty(width * height * channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
     
-    # Reshape to (height, width, 4)
-    pixels = pixels.reshape((height, width, 4))
+    # Reshape to (height, width, channels)
+    pixels = pixels.reshape((height, width, channels))
     
     # Extract grayscale (use R channel)
     grayscale = pixels[:, :, 0]
@@ -161,33 +188,25 @@ def blender_image_to_numpy(image):
 def write_sector_to_file(file_path, height_data, grid_size=65):
     """Write height data back to a .csdat file"""
     try:
-        # Read the entire file first
-        with open(file_path, 'rb') as f:
-            file_content = bytearray(f.read())
-        
-        # Prepare to write terrain data starting at byte 708
-        terrain_offset = 708
-        
-        # Flip the height data vertically back (undo the flip from loading)
-        height_data_flipped = np.flipud(height_data)
-        
-        for y in range(grid_size):
-            for x in range(grid_size):
-                # Convert height back to original scale
-                height_value = int(height_data_flipped[y, x] * 128)
-                # Clamp to valid range
-                height_value = max(0, min(65535, height_value))
-                
-                # Calculate position in file
-                pos = terrain_offset + (y * grid_size + x) * 4
-                
-                # Write height as little-endian 2-byte integer
-                file_content[pos:pos+2] = height_value.to_bytes(2, 'little')
-                # Skip the next 2 bytes (unknown data/flags)
-        
-        # Write back to file
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
+        # Flip the height data vertically back (undo the flip from loading),
+        # convert back to original scale (rounding, so float error from the
+        # normalize/denormalize round trip can't drop a unit) and clamp to
+        # the valid range
+        height_values = np.clip(np.rint(np.flipud(height_data) * 128), 0, 65535).astype('<u2')
+        
+        # Map the terrain block starting at byte 708 as (height, unknown
+        # data/flags) pairs and overwrite only the heights in place
+        with open(file_path, 'r+b') as f:
+            cells = np.memmap(
+                f,
+                dtype='<u2',
+                mode='r+',
+                offset=708,
+                shape=(grid_size, grid_size, 2)
+            )
+            cells[:, :, 0] = height_values
+            cells.flush()
+            del cells
         
         return True
         
@@ -195,6 +214,29 @@ def write_sector_to_file(file_path, height_data, grid_size=65):
         print(f"Error writing to {file_path}: {e}")
         return False
 
+def create_grid_mesh(name, resolution):
+    """Create a flat 2x2 plane mesh with resolution x resolution quad faces"""
+    verts_per_side = resolution + 1
+    
+    # Vertex coordinates, row by row from -1 to 1
+    coords = np.linspace(-1.0, 1.0, verts_per_side)
+    grid_x, grid_y = np.meshgrid(coords, coords)
+    verts = np.column_stack((grid_x.ravel(), grid_y.ravel(), np.zeros(grid_x.size)))
+    
+    # Counter-clockwise quads (normals facing +Z)
+    index = np.arange(verts_per_side * verts_per_side).reshape(verts_per_side, verts_per_side)
+    v00 = index[:-1, :-1].ravel()
+    v10 = index[:-1, 1:].ravel()
+    v11 = index[1:, 1:].ravel()
+    v01 = index[1:, :-1].ravel()
+    faces = np.column_stack((v00, v10, v11, v01))
+    
+    mesh = bpy.data.meshes.new(name)
+    mesh.from_pydata(verts.tolist(), [], faces.tolist())
+    mesh.update()
+    
+    return mesh
+
 # Operator: Import terrain
 class TERRAIN_OT_import(bpy.types.Operator, ImportHelper):
     bl_idname = "terrain.import_csdat"
@@ -260,28 +302,28 @@ class TERRAIN_OT_import(bpy.types.Operator, ImportHelper):
         )
         
         # Create Blender image - rotate texture for shader display
-        terrain_data.heightmap_image = numpy_to_blender_image(combined_map, "TerrainHeightmap", rotate_texture=True)
+        terrain_data.heightmap_image, terrain_data.height_min, terrain_data.height_max = numpy_to_blender_image(
+            combined_map, "TerrainHeightmap", rotate_texture=True
+        )
         
         # Create plane mesh
         total_width = self.sectors_x * terrain_data.grid_size
         total_height = self.sectors_y * terrain_data.grid_size
         
         # Create mesh with subdivisions matching heightmap resolution
-        bpy.ops.mesh.primitive_plane_add(
-            size=2,
-            location=(0, 0, 0),
-            rotation=(0, 0, 3.14159)  # 180 degrees on Z axis (pi radians)
-        )
-        
-        terrain_obj = context.active_object
-        terrain_obj.name = "TerrainMesh"
+        mesh = create_grid_mesh("TerrainMesh", max(total_width, total_height))
+        terrain_obj = bpy.data.objects.new("TerrainMesh", mesh)
+        terrain_obj.location = (0, 0, 0)
+        terrain_obj.rotation_euler = (0, 0, 3.14159)  # 180 degrees on Z axis (pi radians)
+        context.collection.objects.link(terrain_obj)
+        
+        # Make the terrain the only selected, active object
+        for obj in context.selected_objects:
+            obj.select_set(False)
+        terrain_obj.select_set(True)
+        context.view_layer.objects.active = terrain_obj
         terrain_data.terrain_object = terrain_obj
         
-        # Add subdivision
-        bpy.ops.object.mode_set(mode='EDIT')
-        bpy.ops.mesh.subdivide(number_cuts=max(total_width, total_height) - 1)
-        bpy.ops.object.mode_set(mode='OBJECT')
-        
         # Scale to match terrain dimensions
         terrain_obj.scale = (total_width / 2, total_height / 2, 1)
         
@@ -333,12 +375,14 @@ class TERRAIN_OT_import(bpy.types.Operator, ImportHelper):
         # Rotate UVs 90 degrees counter-clockwise to match displacement
         mesh = terrain_obj.data
         uv_layer = mesh.uv_layers.active.data
-        for loop in mesh.loops:
-            uv = uv_layer[loop.index].uv
-            # Rotate 90 degrees counter-clockwise around center (0.5, 0.5)
-            x, y = uv.x - 0.5, uv.y - 0.5
-            uv.x = -y + 0.5
-            uv.y = x + 0.5
+        uvs = np.empty(len(uv_layer) * 2, dtype=np.float32)
+        uv_layer.foreach_get('uv', uvs)
+        uvs = uvs.reshape(-1, 2) - 0.5
+        # Rotate 90 degrees counter-clockwise around center (0.5, 0.5)
+        rotated = np.empty_like(uvs)
+        rotated[:, 0] = -uvs[:, 1] + 0.5
+        rotated[:, 1] = uvs[:, 0] + 0.5
+        uv_layer.foreach_set('uv', rotated.ravel())
         
         # Switch to texture paint mode for editing
         context.view_layer.objects.active = terrain_obj
@@ -378,13 +422,9 @@ class TERRAIN_OT_export(bpy.types.Operator):
         edited_array = np.fliplr(edited_array)        # Undo horizontal flip
         edited_array = np.rot90(edited_array, k=-1)  # Undo heightmap rotation
         
-        # Get original min/max for denormalization
-        all_heights = []
-        for sector_data in terrain_data.sectors_data.values():
-            all_heights.extend(sector_data.flatten())
-        
-        original_min = min(all_heights)
-        original_max = max(all_heights)
+        # Original min/max used to normalize the image on import
+        original_min = terrain_data.height_min
+        original_max = terrain_data.height_max
         
         # Denormalize
         if original_max > original_min:
@@ -393,34 +433,42 @@ class TERRAIN_OT_export(bpy.types.Operator):
             denormalized = edited_array * original_max
         
         # Split back into sectors and write
+        grid_size = terrain_data.grid_size
+        sectors_x = terrain_data.sectors_x
+        sectors_y = terrain_data.sectors_y
         sectors_written = 0
         sectors_failed = 0
         
-        for display_row in range(terrain_data.sectors_y):
-            for col in range(terrain_data.sectors_x):
-                sector_row = terrain_data.sectors_y - 1 - display_row
-                sector_index = sector_row * terrain_data.sectors_x + col
-                
-                # Extract sector data
-                start_y = display_row * terrain_data.grid_size
-                end_y = start_y + terrain_data.grid_size
-                start_x = col * terrain_data.grid_size
-                end_x = start_x + terrain_data.grid_size
-                
-                sector_data = denormalized[start_y:end_y, start_x:end_x]
-                
-                # Write to file
-                file_path = os.path.join(
-                    terrain_data.current_directory,
-                    f"sd{sector_index}.csdat"
-                )
-                
-                if os.path.exists(file_path):
-                    if write_sector_to_file(file_path, sector_data, terrain_data.grid_size):
-                        sectors_written += 1
-                    else:
-                        sectors_failed += 1
-                        self.report({'WARNING'}, f"Failed to write sector {sector_index}")
+        # View the heightmap as (display_row, col, y, x) sector tiles
+        tiles = np.ascontiguousarray(denormalized).reshape(
+            sectors_y, grid_size, sectors_x, grid_size
+        ).swapaxes(1, 2)
+        
+        # Files are independent, so write them on a thread pool
+        with ThreadPoolExecutor() as executor:
+            futures = {}
+            for display_row in range(sectors_y):
+                for col in range(sectors_x):
+                    sector_row = sectors_y - 1 - display_row
+                    sector_index = sector_row * sectors_x + col
+                    
+                    file_path = os.path.join(
+                        terrain_data.current_directory,
+                        f"sd{sector_index}.csdat"
+                    )
+                    
+                    if os.path.exists(file_path):
+                        sector_data = tiles[display_row, col]
+                        future = executor.submit(write_sector_to_file, file_path, sector_data, grid_size)
+                        futures[future] = sector_index
+            
+            # Report from this thread, in sector submission order
+            for future, sector_index in futures.items():
+                if future.result():
+                    sectors_written += 1
+                else:
+                    sectors_failed += 1
+                    self.report({'WARNING'}, f"Failed to write sector {sector_index}")
         
         self.report({'INFO'}, f"Export complete! Written: {sectors_written}, Failed: {sectors_failed}")
         return {'FINISHED'}